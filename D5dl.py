@@ -1,41 +1,215 @@
+import io
 import os
 import asyncio
+import logging
 import time
-import threading
 import mimetypes
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, Optional
 from pyrogram import Client, enums
+from pyrogram.errors import FloodWait
 from pyrogram.types import Message
 import yt_dlp
 import async_os
 from urllib.parse import urlparse
 
+logger = logging.getLogger(__name__)
+
+# Load the MIME database now rather than on the first upload inside the event loop
+mimetypes.init()
+
+SPLIT_BUFFER_SIZE = 8 * 1024 * 1024  # Read buffer reused while splitting large files
+PROGRESS_EDIT_INTERVAL = 3  # Minimum seconds between progress message edits per chat
+GLOBAL_EDIT_RATE = 20  # Progress message edits per second across all chats
+SPEED_SAMPLE_INTERVAL = 0.5  # Minimum seconds between upload speed samples
+PART_SIZE = 2000 * 1024 * 1024  # Largest part sent for files over the upload limit
+DL_WORKERS = int(os.getenv('DL_WORKERS', '2'))  # yt-dlp worker processes
+STREAM_SPLIT_UPLOADS = True  # Upload parts straight from the source file instead of splitting to disk
+
+# File type lookups for choosing the send method
+EXT_TO_TYPE = {
+    '.pdf': 'pdf',
+    '.jpg': 'image', '.jpeg': 'image', '.png': 'image', '.gif': 'image',
+    '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio',
+    '.mp4': 'video', '.mkv': 'video', '.avi': 'video', '.mov': 'video',
+}
+MIME_PREFIX_MAP = (
+    ('image/', 'image'),
+    ('audio/', 'audio'),
+    ('video/', 'video'),
+    ('application/pdf', 'pdf'),
+)
+SEND_METHODS = {
+    'pdf': 'send_document',
+    'image': 'send_photo',
+    'audio': 'send_audio',
+    'video': 'send_video',
+}
+
+
+class FileSection(io.RawIOBase):
+    """Read-only window onto a byte range of a file, uploaded as a single part"""
+
+    def __init__(self, path: str, offset: int, size: int, name: str):
+        super().__init__()
+        self.name = name
+        self._file = open(path, 'rb')
+        self._start = offset
+        self._size = size
+        self._pos = 0
+        self._file.seek(offset)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            new_pos = pos
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + pos
+        elif whence == io.SEEK_END:
+            new_pos = self._size + pos
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        self._pos = max(0, min(new_pos, self._size))
+        self._file.seek(self._start + self._pos)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self._size - self._pos)
+        if n <= 0:
+            return 0
+        n = self._file.readinto(memoryview(buffer)[:n])
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+class TokenBucket:
+    """Non-blocking token bucket rate limiter"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+_worker_progress_queue = None  # Set in each download worker process
+
+
+def _init_dl_worker(progress_queue):
+    """Give a download worker process the queue it reports progress on"""
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+
+
+def _run_ytdl(url: str, ydl_opts: dict, chat_id: int) -> str:
+    """Download url with yt-dlp inside a worker process and return the file path"""
+    def report_progress(d):
+        if d['status'] == 'downloading':
+            _worker_progress_queue.put((chat_id, {
+                'status': 'downloading',
+                'percent': d.get('_percent_str', '0%'),
+                'speed': d.get('_speed_str', 'N/A'),
+                'downloaded': d.get('_downloaded_bytes_str', '0MB'),
+                'total': d.get('_total_bytes_str', '?MB')
+            }))
+
+    with yt_dlp.YoutubeDL({**ydl_opts, 'progress_hooks': [report_progress]}) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return ydl.prepare_filename(info)
+
+
 class DownloadHandler:
     def __init__(self):
         self.active_tasks: Dict[int, bool] = {}
         self.progress_data: Dict[int, dict] = {}
-        self.lock = threading.Lock()
+        self.progress_events: Dict[int, asyncio.Event] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.ydl_opts = {
             'format': 'best',
             'outtmpl': 'downloads/%(title)s.%(ext)s',
-            'progress_hooks': [self.progress_hook],
         }
+        # yt-dlp runs in worker processes so concurrent downloads are not
+        # serialized by the GIL; progress comes back through a queue.
+        # Spawned rather than forked: this process runs threads (Pyrogram,
+        # the progress reader) whose locks a fork could copy mid-use
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.progress_queue = self.mp_context.Queue()
+        self.dl_pool = self.create_dl_pool()
+        self.progress_reader: Optional[threading.Thread] = None
+        # Shared by every chat's updater so concurrent downloads stay under
+        # Telegram's flood limits
+        self.edit_bucket = TokenBucket(rate=GLOBAL_EDIT_RATE, capacity=GLOBAL_EDIT_RATE)
+
+    def create_dl_pool(self) -> ProcessPoolExecutor:
+        """Start the yt-dlp worker processes"""
+        return ProcessPoolExecutor(
+            max_workers=DL_WORKERS,
+            mp_context=self.mp_context,
+            initializer=_init_dl_worker,
+            initargs=(self.progress_queue,)
+        )
 
     async def is_authorized(self, message: Message) -> bool:
         # Implement your authorization logic
         return True
 
-    def progress_hook(self, d):
-        chat_id = d.get('info_dict', {}).get('__original_chat_id')
-        if chat_id and d['status'] == 'downloading':
-            with self.lock:
-                self.progress_data[chat_id] = {
-                    'status': 'downloading',
-                    'percent': d.get('_percent_str', '0%'),
-                    'speed': d.get('_speed_str', 'N/A'),
-                    'downloaded': d.get('_downloaded_bytes_str', '0MB'),
-                    'total': d.get('_total_bytes_str', '?MB')
-                }
+    def progress_hook(self, chat_id: int, progress: dict):
+        """Record a download progress report from a worker process"""
+        # Reports can arrive late; ignore them once the upload phase started
+        current = self.progress_data.get(chat_id, {})
+        if chat_id in self.active_tasks and current.get('status') != 'uploading':
+            self.progress_data[chat_id] = progress
+            self.notify_progress(chat_id)
+
+    def read_progress(self, loop: asyncio.AbstractEventLoop):
+        """Reader thread: forward progress reports from worker processes to the loop"""
+        while True:
+            report = self.progress_queue.get()
+            if report is None:  # Sentinel from close()
+                return
+            try:
+                loop.call_soon_threadsafe(self.progress_hook, *report)
+            except RuntimeError:
+                return  # Event loop already closed
+
+    def close(self):
+        """Stop the progress reader and shut down the download worker processes"""
+        if self.progress_reader is not None:
+            self.progress_queue.put(None)
+            self.progress_reader.join(timeout=5)
+            self.progress_reader = None
+        self.dl_pool.shutdown(cancel_futures=True)
+
+    def notify_progress(self, chat_id: int):
+        """Wake the progress updater for a chat (safe to call from any thread)"""
+        event = self.progress_events.get(chat_id)
+        if event and self.loop:
+            self.loop.call_soon_threadsafe(event.set)
 
     def format_speed(self, speed_bps: float) -> str:
         if speed_bps >= 1024 * 1024:
@@ -54,63 +228,103 @@ class DownloadHandler:
         return f"{size_bytes} B"
 
     def upload_progress(self, current: int, total: int, chat_id: int):
-        now = time.time()
-        with self.lock:
-            data = self.progress_data.get(chat_id, {})
-            last_time = data.get('upload_last_time', now)
-            last_bytes = data.get('upload_last_bytes', 0)
-            elapsed = now - last_time
+        now = time.monotonic()
+        data = self.progress_data.get(chat_id, {})
+        last_time = data.get('upload_last_time', now)
+        elapsed = now - last_time
 
-            speed_bps = (current - last_bytes) / elapsed if elapsed > 0 else 0
-            percent = (current / total) * 100 if total > 0 else 0
+        # Pyrogram calls this for every uploaded chunk; only sample twice a second
+        if 0 < elapsed < SPEED_SAMPLE_INTERVAL and current < total:
+            return
 
-            update_data = {
-                'status': 'uploading',
-                'percent': f"{percent:.1f}%",
-                'upload_speed': self.format_speed(speed_bps),
-                'uploaded': self.format_size(current),
-                'upload_total': self.format_size(total) if total > 0 else "?",
-                'upload_last_time': now,
-                'upload_last_bytes': current
-            }
-            data.update(update_data)
-            self.progress_data[chat_id] = data
+        last_bytes = data.get('upload_last_bytes', 0)
+        if current < last_bytes:  # A new part started
+            last_bytes = 0
+
+        ema_speed = data.get('upload_ema_speed')
+        if elapsed > 0:
+            speed_bps = (current - last_bytes) / elapsed
+            ema_speed = speed_bps if ema_speed is None else 0.8 * ema_speed + 0.2 * speed_bps
+        percent = (current / total) * 100 if total > 0 else 0
+
+        update_data = {
+            'status': 'uploading',
+            'percent': f"{percent:.1f}%",
+            'upload_speed': self.format_speed(ema_speed) if ema_speed is not None else 'Calculating...',
+            'upload_ema_speed': ema_speed,
+            'uploaded': self.format_size(current),
+            'upload_total': self.format_size(total) if total > 0 else "?",
+            'upload_last_time': now,
+            'upload_last_bytes': current
+        }
+        # Progress dicts are replaced, never mutated, so a single
+        # assignment is atomic for readers on other threads
+        self.progress_data[chat_id] = {**data, **update_data}
+        self.notify_progress(chat_id)
+
+    def iter_parts(self, file_path: str, file_size: int, chunk_size: int = PART_SIZE):
+        """Yield FileSection readers covering the file, one per upload part"""
+        base_name = os.path.basename(file_path)
+        for part_num, offset in enumerate(range(0, file_size, chunk_size)):
+            yield FileSection(
+                file_path,
+                offset,
+                min(chunk_size, file_size - offset),
+                f"{base_name}.part{part_num:03d}"
+            )
 
-    async def split_file(self, file_path: str, chunk_size: int = 2000 * 1024 * 1024) -> list:
-        """Split files larger than 2GB into chunks"""
+    async def split_file(self, file_path: str, chunk_size: int = PART_SIZE) -> list:
+        """Split files larger than 2GB into chunks without blocking the event loop"""
+        return await asyncio.to_thread(self._split_file_sync, file_path, chunk_size)
+
+    def _split_file_sync(self, file_path: str, chunk_size: int) -> list:
+        """Blocking part of split_file, run in a worker thread"""
         part_paths = []
         part_num = 0
-        
-        with open(file_path, 'rb') as f:
+        # One reusable buffer instead of a fresh bytes object per read
+        buffer = memoryview(bytearray(SPLIT_BUFFER_SIZE))
+
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
             while True:
                 part_path = f"{file_path}.part{part_num:03d}"
+                written = 0
                 with open(part_path, 'wb') as part_file:
-                    remaining = chunk_size
-                    while remaining > 0:
-                        data = f.read(min(remaining, 100 * 1024 * 1024))
-                        if not data:
+                    while written < chunk_size:
+                        n = f.readinto(buffer[:min(len(buffer), chunk_size - written)])
+                        if not n:
                             break
-                        part_file.write(data)
-                        remaining -= len(data)
-                    
-                    if os.path.getsize(part_path) == 0:
-                        os.remove(part_path)
-                        break
-                    
-                    part_paths.append(part_path)
-                    part_num += 1
-                    
-                if remaining > 0:
+                        part_file.write(buffer[:n])
+                        written += n
+
+                if written == 0:
+                    os.remove(part_path)
                     break
-        
+
+                part_paths.append(part_path)
+                part_num += 1
+
+                if written < chunk_size:
+                    break
+
         return part_paths
 
     async def update_progress(self, client: Client, chat_id: int, msg_id: int):
-        """Update progress every 5 seconds"""
+        """Edit the status message when progress changes, rate limited"""
+        event = self.progress_events[chat_id]
+        last_message = None
+        last_edit = 0.0
         while True:
-            await asyncio.sleep(5)
-            with self.lock:
-                data = self.progress_data.get(chat_id, {})
+            await event.wait()
+            # Progress reported while we sleep is folded into this edit
+            delay = PROGRESS_EDIT_INTERVAL - (time.monotonic() - last_edit)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            event.clear()
+
+            data = self.progress_data.get(chat_id, {})
             
             status = data.get('status', 'idle')
             message = ""
@@ -132,31 +346,47 @@ class DownloadHandler:
             else:
                 continue
 
+            if message == last_message:
+                continue
+
+            # Over the global budget: skip, the next progress report retries
+            if not self.edit_bucket.try_acquire():
+                continue
+
             try:
                 await client.edit_message_text(
                     chat_id=chat_id,
                     message_id=msg_id,
                     text=message
                 )
+                last_message = message
+                last_edit = time.monotonic()
+            except FloodWait as e:
+                logger.warning(f"Progress updates for {chat_id} flood-limited for {e.value}s")
+                await asyncio.sleep(e.value)
             except Exception as e:
                 logger.error(f"Progress update error: {str(e)}")
 
     async def ytdl_download(self, url: str, chat_id: int) -> Optional[str]:
         """Download with progress tracking"""
         try:
-            info_dict = None
-            def ydl_progress(d):
-                nonlocal info_dict
-                if d['status'] == 'finished':
-                    info_dict = d['info_dict']
-
-            ydl_opts = self.ydl_opts.copy()
-            ydl_opts['progress_hooks'] = [ydl_progress, self.progress_hook]
+            loop = asyncio.get_running_loop()
+            if self.progress_reader is None:
+                # Daemon thread so a blocked queue read never holds up interpreter exit
+                self.progress_reader = threading.Thread(
+                    target=self.read_progress, args=(loop,), name='ytdl-progress', daemon=True
+                )
+                self.progress_reader.start()
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=True)
-                filename = ydl.prepare_filename(info)
-                return filename
+            pool = self.dl_pool
+            try:
+                return await loop.run_in_executor(pool, _run_ytdl, url, self.ydl_opts, chat_id)
+            except BrokenProcessPool:
+                # A worker died and took the pool with it; later downloads get a fresh one
+                if self.dl_pool is pool:
+                    self.dl_pool = self.create_dl_pool()
+                    pool.shutdown(wait=False)
+                raise
 
         except Exception as e:
             logger.error(f"Download Error: {str(e)}")
@@ -178,6 +408,8 @@ class DownloadHandler:
 
         try:
             self.active_tasks[chat_id] = True
+            self.loop = asyncio.get_running_loop()
+            self.progress_events[chat_id] = asyncio.Event()
             status_msg = await message.reply("📥 Starting download...")
             progress_task = asyncio.create_task(
                 self.update_progress(client, chat_id, status_msg.id)
@@ -189,62 +421,51 @@ class DownloadHandler:
                 return
 
             # Prepare for upload phase
-            with self.lock:
-                self.progress_data[chat_id] = {
-                    'status': 'uploading',
-                    'percent': '0%',
-                    'upload_speed': 'Calculating...',
-                    'uploaded': '0B',
-                    'upload_total': '?B'
-                }
+            self.progress_data[chat_id] = {
+                'status': 'uploading',
+                'percent': '0%',
+                'upload_speed': 'Calculating...',
+                'uploaded': '0B',
+                'upload_total': '?B'
+            }
 
             # Handle large files
-            file_size = os.path.getsize(file_path)
+            file_size = await asyncio.to_thread(os.path.getsize, file_path)
             if file_size > 2 * 1024**3:
-                split_parts = await self.split_file(file_path)
-                for part in split_parts:
-                    await client.send_document(
-                        chat_id=chat_id,
-                        document=part,
-                        caption=f"📥 Downloaded from {url}\n💳 Name: {os.path.basename(file_path)}\n🔗 Part: {os.path.basename(part)}",
-                        progress=self.upload_progress,
-                        progress_args=(chat_id,)
-                    )
-                    await async_os.remove(part)
+                if STREAM_SPLIT_UPLOADS:
+                    parts = self.iter_parts(file_path, file_size)
+                else:
+                    parts = await self.split_file(file_path)
+
+                for part in parts:
+                    part_name = part.name if isinstance(part, FileSection) else os.path.basename(part)
+                    try:
+                        await client.send_document(
+                            chat_id=chat_id,
+                            document=part,
+                            file_name=part_name,
+                            caption=f"📥 Downloaded from {url}\n💳 Name: {os.path.basename(file_path)}\n🔗 Part: {part_name}",
+                            progress=self.upload_progress,
+                            progress_args=(chat_id,)
+                        )
+                    finally:
+                        if isinstance(part, FileSection):
+                            part.close()
+                        else:
+                            await async_os.remove(part)
                 await async_os.remove(file_path)
                 return
 
             # Determine file type and send
-            mime_type, _ = mimetypes.guess_type(file_path)
             file_extension = os.path.splitext(file_path)[1].lower()
-
-            file_type = 'document'
-            if mime_type:
-                if mime_type.startswith('image'):
-                    file_type = 'image'
-                elif mime_type.startswith('audio'):
-                    file_type = 'audio'
-                elif mime_type.startswith('video'):
-                    file_type = 'video'
-                elif mime_type == 'application/pdf':
-                    file_type = 'pdf'
-            else:
-                if file_extension == '.pdf':
-                    file_type = 'pdf'
-                elif file_extension in ('.jpg', '.jpeg', '.png', '.gif'):
-                    file_type = 'image'
-                elif file_extension in ('.mp3', '.wav', '.ogg'):
-                    file_type = 'audio'
-                elif file_extension in ('.mp4', '.mkv', '.avi', '.mov'):
-                    file_type = 'video'
-
-            send_methods = {
-                'pdf': client.send_document,
-                'image': client.send_photo,
-                'audio': client.send_audio,
-                'video': client.send_video
-            }
-            method = send_methods.get(file_type, client.send_document)
+            file_type = EXT_TO_TYPE.get(file_extension)
+            if not file_type:
+                mime_type, _ = mimetypes.guess_type(file_path)
+                file_type = next(
+                    (t for prefix, t in MIME_PREFIX_MAP if mime_type and mime_type.startswith(prefix)),
+                    'document'
+                )
+            method = getattr(client, SEND_METHODS.get(file_type, 'send_document'))
 
             caption = f"📥 Downloaded from {url}\n💳 Name: {os.path.basename(file_path)}"
 
@@ -263,7 +484,7 @@ class DownloadHandler:
             await message.reply("❌ Error processing the request")
         finally:
             self.active_tasks.pop(chat_id, None)
+            self.progress_events.pop(chat_id, None)
             if 'progress_task' in locals():
                 progress_task.cancel()
-            with self.lock:
-                self.progress_data.pop(chat_id, None)
+            self.progress_data.pop(chat_id, None)
@@ -1,12 +1,13 @@
+import asyncio
 import logging
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.handlers import MessageHandler
-import requests
+import aiohttp
 import hashlib
-import json
+import orjson
 import os
-from apscheduler.schedulers.background import BackgroundScheduler
-from bs4 import BeautifulSoup
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from lxml import etree, html as lxml_html
 from urllib.parse import urljoin, urlparse
 from datetime import datetime
 import requests.utils as requests_utils
@@ -24,42 +25,47 @@ SUDO_USERS_FILE = 'sudo_users.json'  # File to store sudo users
 
 OWNER_ID = 6556141430  # Replace with your Telegram ID
 
+DOCUMENT_EXTENSIONS = ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt')
+
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=10)
+_http_session = None  # Shared aiohttp session, created on first use
+UNCHANGED = object()  # Returned by fetch_url_content when the server answers 304
+
+# In-memory copies of the data files, loaded once at startup
+USER_DATA = {}
+AUTHORIZED_CHANNELS = set()
+SUDO_USERS = set()
+_DATA_FILES = {
+    USER_DATA_FILE: USER_DATA,
+    CHANNELS_FILE: AUTHORIZED_CHANNELS,
+    SUDO_USERS_FILE: SUDO_USERS,
+}
+_dirty_files = set()  # Data files with changes not yet written to disk
+
 def is_authorized_user(user_id):
     """Check if the user is the owner or a sudo user"""
-    sudo_users = load_sudo_users()
-    return user_id == OWNER_ID or user_id in sudo_users
+    return user_id == OWNER_ID or user_id in SUDO_USERS
 
 def is_authorized_channel(channel_id):
     """Check if the channel is authorized"""
-    authorized_channels = load_channels()
-    return channel_id in authorized_channels
+    return channel_id in AUTHORIZED_CHANNELS
 
 def load_channels():
     """Load authorized channel IDs from file"""
     try:
-        with open(CHANNELS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(CHANNELS_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return []
 
-def save_channels(channels):
-    """Save authorized channel IDs to file"""
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels, f, indent=4)
-
 def load_sudo_users():
     """Load sudo users from file"""
     try:
-        with open(SUDO_USERS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(SUDO_USERS_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return []
 
-def save_sudo_users(sudo_users):
-    """Save sudo users to file"""
-    with open(SUDO_USERS_FILE, 'w') as f:
-        json.dump(sudo_users, f, indent=4)
-
 def get_domain(url):
     """Extract domain from URL"""
     parsed_uri = urlparse(url)
@@ -68,40 +74,135 @@ def get_domain(url):
 def load_user_data():
     """Load user data from file"""
     try:
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(USER_DATA_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return {}
 
-def save_user_data(user_data):
-    """Save user data to file"""
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(user_data, f, indent=4)
+def load_data_files():
+    """Load all data files into memory"""
+    USER_DATA.update(load_user_data())
+    AUTHORIZED_CHANNELS.update(load_channels())
+    SUDO_USERS.update(load_sudo_users())
+
+def mark_dirty(path):
+    """Queue a data file to be written by the next flush"""
+    _dirty_files.add(path)
+
+def _atomic_write(path, payload):
+    """Write payload through a temp file so the data file is never half-written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+def _serializable(data):
+    """Convert in-memory ID sets back to the JSON lists stored on disk"""
+    return sorted(data) if isinstance(data, set) else data
+
+def _take_dirty_payloads():
+    """Serialize every dirty data file and clear the dirty set"""
+    payloads = [
+        (path, orjson.dumps(_serializable(_DATA_FILES[path])))
+        for path in _dirty_files
+    ]
+    _dirty_files.clear()
+    return payloads
+
+async def flush_data_files():
+    """Write changed data files to disk (runs every second)"""
+    for path, payload in _take_dirty_payloads():
+        try:
+            await asyncio.to_thread(_atomic_write, path, payload)
+        except OSError as e:
+            mark_dirty(path)  # Retry on the next flush
+            logger.error(f"Error writing {path}: {e}")
+
+def flush_data_files_sync():
+    """Write changed data files to disk before exiting"""
+    for path, payload in _take_dirty_payloads():
+        try:
+            _atomic_write(path, payload)
+        except OSError as e:
+            logger.error(f"Error writing {path}: {e}")
+
+def get_http_session():
+    """Return the shared HTTP session, creating it on first use"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=50, keepalive_timeout=60, ttl_dns_cache=300)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'Accept-Encoding': 'gzip, deflate'}
+        )
+    return _http_session
+
+async def close_http_session():
+    """Close the shared HTTP session"""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+async def fetch_url_content(url, etag=None, last_modified=None):
+    """Fetch raw website bytes, returning (content, etag, last_modified, charset)
+
+    When validators from a previous fetch are given and the server replies
+    304 Not Modified, content is UNCHANGED and the body is never downloaded.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
 
-def fetch_url_content(url):
-    """Fetch website content"""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.text
+        session = get_http_session()
+        async with session.get(url, headers=headers, timeout=FETCH_TIMEOUT) as response:
+            if response.status == 304:
+                return UNCHANGED, etag, last_modified, None
+            response.raise_for_status()
+            content = await response.read()
+            return (
+                content,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                response.charset
+            )
     except Exception as e:
         logger.error(f"Error fetching {url}: {e}")
-        return None
+        return None, None, None, None
+
+def extract_documents(html_content, base_url, charset=None):
+    """Extract document links from raw HTML bytes
+
+    The charset from the HTTP Content-Type header takes priority; without it
+    lxml sniffs the encoding from the page's <meta> tags while parsing.
+    """
+    try:
+        try:
+            parser = lxml_html.HTMLParser(encoding=charset) if charset else None
+            tree = lxml_html.fromstring(html_content, parser=parser)
+        except LookupError:
+            # Charset lxml doesn't know; let it sniff the encoding instead
+            tree = lxml_html.fromstring(html_content)
+    except (etree.ParserError, ValueError):
+        return []  # Empty or unparsable page
 
-def extract_documents(html_content, base_url):
-    """Extract document links from HTML"""
-    soup = BeautifulSoup(html_content, 'lxml')
-    document_extensions = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt']
     documents = []
+    seen_urls = set()
 
-    for link in soup.find_all('a', href=True):
-        href = link['href']
+    for link in tree.iter('a'):
+        href = link.get('href')
+        if not href:
+            continue
         # Proper URL encoding handling
         encoded_href = requests_utils.requote_uri(href)
         absolute_url = urljoin(base_url, encoded_href)
-        link_text = link.text.strip()
+        if absolute_url in seen_urls:
+            continue
 
-        if any(absolute_url.lower().endswith(ext) for ext in document_extensions):
+        if absolute_url.lower().endswith(DOCUMENT_EXTENSIONS):
+            seen_urls.add(absolute_url)
+            link_text = (link.text_content() or '').strip()
             # Use link text or filename as document name
             if not link_text:
                 filename = os.path.basename(absolute_url)
@@ -111,8 +212,7 @@ def extract_documents(html_content, base_url):
                 'url': absolute_url
             })
 
-    # Remove duplicates
-    return list({doc['url']: doc for doc in documents}.values())
+    return documents
 
 async def create_document_file(url, documents):
     """Create TXT file with documents list"""
@@ -128,19 +228,37 @@ async def create_document_file(url, documents):
 
 async def check_website_updates(client):
     """Check for website updates"""
-    user_data = load_user_data()
-    for user_id, data in user_data.items():
-        for url_info in data['tracked_urls']:
+    # Fetch every tracked URL concurrently, once per URL and validator pair
+    requests_to_send = list({
+        (url_info['url'], url_info.get('etag'), url_info.get('last_modified'))
+        for data in USER_DATA.values() for url_info in data['tracked_urls']
+    })
+    results = await asyncio.gather(
+        *[fetch_url_content(*request) for request in requests_to_send],
+        return_exceptions=True
+    )
+    responses = dict(zip(requests_to_send, results))
+
+    # Iterate over snapshots since handlers may change USER_DATA while we await
+    for user_id, data in list(USER_DATA.items()):
+        for url_info in list(data['tracked_urls']):
             url = url_info['url']
             stored_hash = url_info['hash']
             stored_documents = url_info['documents']
 
-            current_content = fetch_url_content(url)
-            if not current_content:
+            result = responses.get((url, url_info.get('etag'), url_info.get('last_modified')))
+            if not result or isinstance(result, Exception):
+                continue
+
+            current_content, etag, last_modified, charset = result
+            if current_content is UNCHANGED or not current_content:
                 continue
 
-            current_hash = hashlib.sha256(current_content.encode()).hexdigest()
-            current_documents = extract_documents(current_content, url)
+            url_info['etag'] = etag
+            url_info['last_modified'] = last_modified
+
+            current_hash = hashlib.sha256(current_content).hexdigest()
+            current_documents = extract_documents(current_content, url, charset)
 
             if current_hash != stored_hash:
                 try:
@@ -153,8 +271,9 @@ async def check_website_updates(client):
                     logger.error(f"Error sending update to {user_id}: {e}")
 
                 # Check for new documents
+                stored_urls = {doc['url'] for doc in stored_documents}
                 new_docs = [doc for doc in current_documents
-                            if doc not in stored_documents]
+                            if doc['url'] not in stored_urls]
 
                 if new_docs:
                     try:
@@ -173,7 +292,7 @@ async def check_website_updates(client):
                     url_info['documents'] = current_documents
                     url_info['hash'] = current_hash
 
-    save_user_data(user_data)
+    mark_dirty(USER_DATA_FILE)
 
 async def start(client, message):
     """Handle /start command"""
@@ -219,29 +338,36 @@ async def track(client, message):
         await message.reply_text("⚠ Please enter a valid URL (with http/https)")
         return
 
-    user_data = load_user_data()
-    if user_id not in user_data:
-        user_data[user_id] = {'tracked_urls': []}
+    if user_id not in USER_DATA:
+        USER_DATA[user_id] = {'tracked_urls': []}
 
-    if any(u['url'] == url for u in user_data[user_id]['tracked_urls']):
+    if any(u['url'] == url for u in USER_DATA[user_id]['tracked_urls']):
         await message.reply_text("❌ This URL is already being tracked")
         return
 
-    content = fetch_url_content(url)
+    content, etag, last_modified, charset = await fetch_url_content(url)
     if not content:
         await message.reply_text("❌ Could not access URL")
         return
 
-    current_hash = hashlib.sha256(content.encode()).hexdigest()
-    current_documents = extract_documents(content, url)
+    current_hash = hashlib.sha256(content).hexdigest()
+    current_documents = extract_documents(content, url, charset)
 
-    user_data[user_id]['tracked_urls'].append({
+    # A concurrent /track for the same URL may have finished during the fetch
+    tracked_urls = USER_DATA.setdefault(user_id, {'tracked_urls': []})['tracked_urls']
+    if any(u['url'] == url for u in tracked_urls):
+        await message.reply_text("❌ This URL is already being tracked")
+        return
+
+    tracked_urls.append({
         'url': url,
         'hash': current_hash,
-        'documents': current_documents
+        'documents': current_documents,
+        'etag': etag,
+        'last_modified': last_modified
     })
 
-    save_user_data(user_data)
+    mark_dirty(USER_DATA_FILE)
     await message.reply_text(f"✅ Tracking started: {url}\nFound documents: {len(current_documents)}")
 
 async def untrack(client, message):
@@ -261,19 +387,18 @@ async def untrack(client, message):
     user_id = str(message.from_user.id or message.chat.id)
     url = ' '.join(message.command[1:]).strip()
 
-    user_data = load_user_data()
-    if user_id not in user_data:
+    if user_id not in USER_DATA:
         await message.reply_text("❌ No tracked URLs found")
         return
 
-    original_count = len(user_data[user_id]['tracked_urls'])
-    user_data[user_id]['tracked_urls'] = [
-        u for u in user_data[user_id]['tracked_urls']
+    original_count = len(USER_DATA[user_id]['tracked_urls'])
+    USER_DATA[user_id]['tracked_urls'] = [
+        u for u in USER_DATA[user_id]['tracked_urls']
         if u['url'] != url
     ]
 
-    if len(user_data[user_id]['tracked_urls']) < original_count:
-        save_user_data(user_data)
+    if len(USER_DATA[user_id]['tracked_urls']) < original_count:
+        mark_dirty(USER_DATA_FILE)
         await message.reply_text(f"❎ Tracking stopped: {url}")
     else:
         await message.reply_text("❌ URL not found")
@@ -293,13 +418,12 @@ async def list_urls(client, message):
         return
 
     user_id = str(message.from_user.id or message.chat.id)
-    user_data = load_user_data()
 
-    if user_id not in user_data or not user_data[user_id]['tracked_urls']:
+    if user_id not in USER_DATA or not USER_DATA[user_id]['tracked_urls']:
         await message.reply_text("📭 You're not tracking any URLs")
         return
 
-    urls = "\n".join([u['url'] for u in user_data[user_id]['tracked_urls']])
+    urls = "\n".join([u['url'] for u in USER_DATA[user_id]['tracked_urls']])
     await message.reply_text(f"📜 Tracked URLs:\n\n{urls}")
 
 async def list_documents(client, message):
@@ -319,12 +443,11 @@ async def list_documents(client, message):
     user_id = str(message.from_user.id or message.chat.id)
     url = ' '.join(message.command[1:]).strip()
 
-    user_data = load_user_data()
-    if user_id not in user_data or not user_data[user_id]['tracked_urls']:
+    if user_id not in USER_DATA or not USER_DATA[user_id]['tracked_urls']:
         await message.reply_text("❌ You're not tracking any URLs")
         return
 
-    url_info = next((u for u in user_data[user_id]['tracked_urls'] if u['url'] == url), None)
+    url_info = next((u for u in USER_DATA[user_id]['tracked_urls'] if u['url'] == url), None)
     if not url_info:
         await message.reply_text("❌ This URL is not being tracked")
         return
@@ -352,14 +475,13 @@ async def add_channel(client, message):
         return
 
     channel_id = int(message.command[1])
-    authorized_channels = load_channels()
 
-    if channel_id in authorized_channels:
+    if channel_id in AUTHORIZED_CHANNELS:
         await message.reply_text("❌ This channel is already authorized.")
         return
 
-    authorized_channels.append(channel_id)
-    save_channels(authorized_channels)
+    AUTHORIZED_CHANNELS.add(channel_id)
+    mark_dirty(CHANNELS_FILE)
     await message.reply_text(f"✅ Channel {channel_id} has been authorized.")
 
 async def remove_channel(client, message):
@@ -369,14 +491,13 @@ async def remove_channel(client, message):
         return
 
     channel_id = int(message.command[1])
-    authorized_channels = load_channels()
 
-    if channel_id not in authorized_channels:
+    if channel_id not in AUTHORIZED_CHANNELS:
         await message.reply_text("❌ This channel is not authorized.")
         return
 
-    authorized_channels.remove(channel_id)
-    save_channels(authorized_channels)
+    AUTHORIZED_CHANNELS.remove(channel_id)
+    mark_dirty(CHANNELS_FILE)
     await message.reply_text(f"❎ Channel {channel_id} has been removed from authorized channels.")
 
 async def add_sudo_user(client, message):
@@ -386,14 +507,13 @@ async def add_sudo_user(client, message):
         return
 
     sudo_user_id = int(message.command[1])
-    sudo_users = load_sudo_users()
 
-    if sudo_user_id in sudo_users:
+    if sudo_user_id in SUDO_USERS:
         await message.reply_text("❌ This user is already a sudo user.")
         return
 
-    sudo_users.append(sudo_user_id)
-    save_sudo_users(sudo_users)
+    SUDO_USERS.add(sudo_user_id)
+    mark_dirty(SUDO_USERS_FILE)
     await message.reply_text(f"✅ User {sudo_user_id} has been added as a sudo user.")
 
 async def remove_sudo_user(client, message):
@@ -403,18 +523,39 @@ async def remove_sudo_user(client, message):
         return
 
     sudo_user_id = int(message.command[1])
-    sudo_users = load_sudo_users()
 
-    if sudo_user_id not in sudo_users:
+    if sudo_user_id not in SUDO_USERS:
         await message.reply_text("❌ This user is not a sudo user.")
         return
 
-    sudo_users.remove(sudo_user_id)
-    save_sudo_users(sudo_users)
+    SUDO_USERS.remove(sudo_user_id)
+    mark_dirty(SUDO_USERS_FILE)
     await message.reply_text(f"❎ User {sudo_user_id} has been removed from sudo users.")
 
+async def run_bot(app):
+    """Start the bot and its scheduled jobs on the bot's event loop"""
+    await app.start()
+
+    # Setup scheduler; a slow update check is never run twice at once
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(
+        check_website_updates, 'interval', minutes=30, args=[app],
+        max_instances=1, coalesce=True, misfire_grace_time=60
+    )
+    scheduler.add_job(flush_data_files, 'interval', seconds=1, max_instances=1, coalesce=True)
+    scheduler.start()
+
+    try:
+        await idle()
+    finally:
+        scheduler.shutdown(wait=False)
+        await app.stop()
+        await close_http_session()
+
 def main():
     """Main application"""
+    load_data_files()
+
     app = Client(
         "my_bot",
         api_id="",
@@ -438,15 +579,12 @@ def main():
     for handler in handlers:
         app.add_handler(handler)
 
-    # Setup scheduler
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(check_website_updates, 'interval', minutes=30, args=[app])
-    scheduler.start()
-
     try:
-        app.run()
+        app.run(run_bot(app))
     except Exception as e:
         logger.error(f"Error running bot: {e}")
+    finally:
+        flush_data_files_sync()
 
 if __name__ == '__main__':
     main()
@@ -1,63 +1,54 @@
-    async def track_statistics(self, event_type: str, user_id: int, url: str, success: bool = True):
-        """Record statistics for analysis"""
-        await MongoDB.stats.update_one(
-            {'user_id': user_id, 'url': url},
-            {'$inc': {f'stats.{event_type}.{"success" if success else "failure"}': 1}},
-            upsert=True
-        )
-
-    async def get_statistics(self, user_id: int) -> Dict:
-        """Get aggregated statistics for user"""
-        pipeline = [
-            {'$match': {'user_id': user_id}},
-            {'$group': {
-                '_id': None,
-                'total_tracked': {'$sum': 1},
-                'success_downloads': {'$sum': '$stats.downloads.success'},
-                'failed_downloads': {'$sum': '$stats.downloads.failure'},
-                'uptime_percentage': {
-                    '$avg': {
-                        '$cond': [
-                            {'$eq': ['$stats.checks.success', 0]},
-                            0,
-                            {'$divide': ['$stats.checks.success', {'$add': ['$stats.checks.success', '$stats.checks.failure']}]}
-                        ]
-                    }
-                }
-            }}
-        ]
-
-        result = await MongoDB.stats.aggregate(pipeline).to_list(1)
-        return result[0] if result else {}
-
     # Archives system
-    async def create_archive(self, user_id: int, url: str, content: str):
-        """Create historical archive of webpage content"""
+    async def create_archive(self, user_id: int, url: str, content: str, content_hash: str = '',
+                             timestamp: Optional[datetime] = None):
+        """Create historical archive of webpage content (zstd-compressed)"""
+        raw = content.encode()
         await MongoDB.archives.insert_one({
             'user_id': user_id,
             'url': url,
-            'content': content,
-            'timestamp': datetime.now()
+            'content': Binary(ARCHIVE_COMPRESSOR.compress(raw)),
+            'content_hash': content_hash,
+            'size': len(raw),
+            'timestamp': timestamp or datetime.now(LOCAL_TZ)
         })
 
     async def get_archives(self, user_id: int, url: str) -> List[Dict]:
-        """Retrieve archives for specific URL"""
-        return await MongoDB.archives.find({
-            'user_id': user_id,
-            'url': url
-        }).sort('timestamp', -1).to_list(None)
+        """Retrieve archive metadata for specific URL; see get_archive_content"""
+        return await MongoDB.archives.find(
+            {'user_id': user_id, 'url': url},
+            {'content': 0}
+        ).sort('timestamp', -1).to_list(None)
+
+    async def get_archive_content(self, archive_id) -> Optional[str]:
+        """Load and decompress the content of a single archive"""
+        archive = await MongoDB.archives.find_one({'_id': archive_id}, {'content': 1})
+        if not archive:
+            return None
+        content = archive['content']
+        if isinstance(content, str):
+            return content  # Stored uncompressed before archives were zstd-compressed
+        return ARCHIVE_DECOMPRESSOR.decompress(content).decode()
 
     # Content diff system
     async def generate_diff(self, old_content: str, new_content: str) -> str:
         """Generate human-readable diff between versions"""
+        # The result is cut to MAX_MESSAGE_LENGTH anyway, so bound the input too
         diff = difflib.unified_diff(
-            old_content.splitlines(),
-            new_content.splitlines(),
+            old_content[:DIFF_MAX_CHARS].splitlines(),
+            new_content[:DIFF_MAX_CHARS].splitlines(),
             fromfile='Previous',
             tofile='Current',
             lineterm=''
         )
-        return '\n'.join(diff)[:MAX_MESSAGE_LENGTH]
+
+        lines = []
+        size = 0
+        for line in diff:
+            lines.append(line)
+            size += len(line) + 1
+            if size >= MAX_MESSAGE_LENGTH:
+                break
+        return '\n'.join(lines)[:MAX_MESSAGE_LENGTH]
 
     # Notification system
     async def send_notification(self, user_id: int, url: str, changes: str):
@@ -73,82 +64,39 @@
             await self.app.send_message(user_id, f"<b>Update detected</b> for {url}:\n<pre>{changes}</pre>", parse_mode=enums.ParseMode.HTML)
 
     # Maintenance jobs
-    async def cleanup_old_archives(self):
-        """Cleanup archives older than retention period"""
-        cutoff = datetime.now() - timedelta(days=ARCHIVE_RETENTION_DAYS)
-        await MongoDB.archives.delete_many({'timestamp': {'$lt': cutoff}})
-        logger.info("Cleaned up old archives")
-
     async def aggregate_statistics(self):
-        """Aggregate statistics for better performance"""
-        # Implement your aggregation logic here
+        """Hourly job: rebuild every stats_rollup document from the per-URL stats on the server"""
+        # Hold off flushes so none lands between the pipeline's read and its $merge
+        async with self._stats_lock:
+            await self._write_stats_buf()
+            cursor = await MongoDB.stats.aggregate(rollup_pipeline({}) + [ROLLUP_MERGE])
+            await cursor.to_list(None)  # $merge writes server-side and returns no documents
         logger.info("Statistics aggregation completed")
 
-    # Updated tracking logic
-    async def check_updates(self, user_id: int, url: str):
-        try:
-            tracked_data = await MongoDB.urls.find_one({'user_id': user_id, 'url': url})
-            if not tracked_data:
-                return
-
-            # Night mode check 
-            if tracked_data.get('night_mode'):
-                tz = pytz.timezone(TIMEZONE)
-                now = datetime.now(tz)
-                if not (9 <= now.hour < 22):  # From 9 AM To 10 PM
-                    logger.info(f"Due to night mode, {url} was skipped" )
-                    return
-
-            current_content, new_resources = await self.get_webpage_content(url)
-            await self.create_archive(user_id, url, current_content)
-
-            previous_hash = tracked_data.get('content_hash', '')
-            current_hash = hashlib.md5(current_content.encode()).hexdigest()
-
-            if current_hash != previous_hash:
-                diff_content = await self.generate_diff(
-                    tracked_data.get('content', ''),
-                    current_content
-                )
-                await self.send_notification(user_id, url, diff_content)
-
-                await self.track_statistics('content_changes', user_id, url)
-
-            filtered_resources = []
-            for resource in new_resources:
-                if await self.apply_filters(resource, user_id):
-                    filtered_resources.append(resource)
-
-            if filtered_resources:
-                sent_hashes = []
-                for resource in filtered_resources:
-                    if await self.send_media(user_id, resource, tracked_data):
-                        sent_hashes.append(resource['hash'])
-                        await self.track_statistics('downloads', user_id, url, success=True)
-                    else:
-                        await self.track_statistics('downloads', user_id, url, success=False)
-
-                update_data = {
-                    'content_hash': current_hash,
-                    'last_checked': datetime.now()
-                }
-
-                if sent_hashes:
-                    update_data['$push'] = {'sent_hashes': {'$each': sent_hashes}}
-
-                await MongoDB.urls.update_one(
-                    {'_id': tracked_data['_id']},
-                    {'$set': update_data}
-                )
-
-        except Exception as e:
-            logger.error(f"Update check failed for {url}: {str(e)}")
-            await self.track_statistics('checks', user_id, url, success=False)
-
     # New command handlers
     async def filter_handler(self, client: Client, message: Message):
-        """Handle filter configuration"""
-        pass  # Implement filter configuration logic
+        """Handle filter configuration: /filter types <t1,t2> | block <.ext,...> | clear"""
+        try:
+            user_id = message.chat.id
+            action = message.command[1].lower()
+            values = [v.strip().lower() for v in ' '.join(message.command[2:]).split(',') if v.strip()]
+
+            if action == 'types':
+                update = {'$set': {'types': values}}
+            elif action == 'block':
+                update = {'$set': {'blocked_extensions': values}}
+            elif action == 'clear':
+                update = {'$unset': {'types': '', 'blocked_extensions': ''}}
+            else:
+                return await message.reply("Usage: /filter types <t1,t2> | block <.ext,...> | clear")
+
+            await MongoDB.filters.update_one({'user_id': user_id}, update, upsert=True)
+            self.filter_settings.cache_invalidate(user_id)
+            await message.reply("✅ Filters updated")
+        except IndexError:
+            await message.reply("Usage: /filter types <t1,t2> | block <.ext,...> | clear")
+        except Exception as e:
+            await message.reply(f"Filter update failed: {str(e)}")
 
     async def export_handler(self, client: Client, message: Message):
         """Handle export commands"""
@@ -158,8 +106,10 @@
                 return await message.reply("Invalid format. Use /export json|csv")
 
             filename = await self.export_data(message.chat.id, format)
-            await message.reply_document(filename)
-            await async_os.remove(filename)
+            try:
+                await message.reply_document(filename, file_name=f"tracked_urls.{format}")
+            finally:
+                await async_os.remove(filename)
         except Exception as e:
             await message.reply(f"Export failed: {str(e)}")
 
@@ -187,119 +137,53 @@
         pass  # Implement notification configuration
 
     # Enhanced Web Monitoring
-    async def get_webpage_content(self, url: str) -> Tuple[str, List[Dict]]:
+    async def get_webpage_content(self, url: str, previous_hash: Optional[str] = None) -> Tuple[Optional[str], Optional[List[Dict]], str]:
+        """Fetch a page as (content, resources, content_hash)
+
+        The body is hashed while it streams in. If the hash equals
+        previous_hash, parsing is skipped and (None, None, hash) is returned.
+        """
         try:
             async with self.http.get(url, timeout=30) as resp:
-                content = await resp.text()
-                soup = BeautifulSoup(content, 'lxml')
+                hasher = xxhash.xxh3_64()
+                body = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    hasher.update(chunk)
+                    body += chunk
+
+                content_hash = hasher.hexdigest()
+                if content_hash == previous_hash:
+                    return None, None, content_hash
+
+                content = body.decode(resolve_charset(resp.charset, body), 'replace')
+                tree = HTMLParser(content)
 
                 resources = []
                 seen_hashes = set()
+                join, unescape, ext_to_type = urljoin, unquote, EXT_TO_TYPE
 
-                for tag in soup.find_all(['a', 'img', 'audio', 'video', 'source']):
+                for node in tree.css('a, img, audio, video, source'):
+                    attrs = node.attributes
                     resource_url = None
-                    if tag.name == 'a' and (href := tag.get('href')):
-                        resource_url = unquote(urljoin(url, href))
-                    elif (src := tag.get('src')):
-                        resource_url = unquote(urljoin(url, src))
+                    if node.tag == 'a' and (href := attrs.get('href')):
+                        resource_url = unescape(join(url, href))
+                    elif (src := attrs.get('src')):
+                        resource_url = unescape(join(url, src))
 
                     if resource_url:
                         ext = os.path.splitext(resource_url)[1].lower()
-                        for file_type, extensions in SUPPORTED_EXTENSIONS.items():
-                            if ext in extensions:
-                                file_hash = hashlib.md5(resource_url.encode()).hexdigest()
-                                resources.append({
-                                    'url': resource_url,
-                                    'type': file_type,
-                                    'hash': file_hash
-                                })
-                                break
-
-                return content, resources
+                        file_type = ext_to_type.get(ext)
+                        if file_type:
+                            file_hash = hashlib.md5(resource_url.encode()).hexdigest()
+                            resources.append({
+                                'url': resource_url,
+                                'type': file_type,
+                                'hash': file_hash
+                            })
+
+                return content, resources, content_hash
         except Exception as e:
             logger.error(f"Web monitoring error: {str(e)}")
-            return "", []
-
-    async def check_updates(self, user_id: int, url: str):
-        try:
-            tracked_data = await MongoDB.urls.find_one({'user_id': user_id, 'url': url})
-            if not tracked_data:
-                return
-
-            current_content, new_resources = await self.get_webpage_content(url)
-            previous_hash = tracked_data.get('content_hash', '')
-            current_hash = hashlib.md5(current_content.encode()).hexdigest()
-
-            if current_hash != previous_hash or new_resources:
-                text_changes = f"🔄 Website Updated: {url}\n" + \
-                             f"📅 Change detected at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-
-                await self.safe_send_message(user_id, text_changes)
-
-                sent_hashes = []
-                for resource in new_resources:
-                    if resource['hash'] not in tracked_data.get('sent_hashes', []):
-                        if await self.send_media(user_id, resource, tracked_data):
-                            sent_hashes.append(resource['hash'])
-
-                update_data = {
-                    'content_hash': current_hash,
-                    'last_checked': datetime.now()
-                }
-
-                if sent_hashes:
-                    update_data['$push'] = {'sent_hashes': {'$each': sent_hashes}}
-
-                await MongoDB.urls.update_one(
-                    {'_id': tracked_data['_id']},
-                    {'$set': update_data}
-                )
-
-        except Exception as e:
-            logger.error(f"Update check failed for {url}: {str(e)}")
-            await self.app.send_message(user_id, f"⚠️ Error checking updates for {url}")
-
-    # Media Sending
-    async def send_media(self, user_id: int, resource: Dict, tracked_data: Dict) -> bool:
-        try:
-            caption = (
-                f"📁 {tracked_data.get('name', 'Unnamed')}\n"
-                f"🔗 Source: {tracked_data['url']}\n"
-                f"📥 Direct URL: {resource['url']}"
-            )
-
-            file_path = await self.ytdl_download(resource['url'])
-            if not file_path:
-                file_path = await self.direct_download(resource['url'])
-
-            if not file_path:
-                return False
-
-            file_size = os.path.getsize(file_path)
-            if file_size > MAX_FILE_SIZE:
-                logger.warning(f"File too big: {file_size} bytes")
-                return False
-
-            send_methods = {
-                'pdf': self.app.send_document,
-                'image': self.app.send_photo,
-                'audio': self.app.send_audio,
-                'video': self.app.send_video
-            }
-
-            method = send_methods.get(resource['type'], self.app.send_document)
-            await method(
-                user_id,
-                file_path,
-                caption=caption[:1024],
-                parse_mode=enums.ParseMode.HTML
-            )
-
-            await async_os.remove(file_path)
-            return True
-
-        except Exception as e:
-            logger.error(f"Media send failed: {str(e)}")
-            return False
+            return "", [], ""
 
 Es code ko achha kijiye taki sb kuchh shi tarike se ho
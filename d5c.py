@@ -1,62 +1,278 @@
 # Added necessary imports (assuming at top)
 import asyncio
-from typing import Dict, List, Tuple
-from datetime import datetime, timedelta
+import aiohttp
+import codecs
+import csv
+import io
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from zoneinfo import ZoneInfo
 import difflib
 import hashlib
+import xxhash
 import os
-from urllib.parse import unquote
-from tempfile import TemporaryDirectory
+from urllib.parse import unquote, urljoin
+from tempfile import TemporaryDirectory, mkstemp
+from bson import Binary
+from pymongo import AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from pyrogram.errors import FloodWait
+from selectolax.parser import HTMLParser
+import orjson
+import zstandard as zstd
+from async_lru import alru_cache
+
+# Native asyncio driver (PyMongo 4.9+); no Motor thread-pool hop per operation
+MongoDB = AsyncMongoClient(MONGO_URI).get_default_database()
+
+# Night mode hours are judged in this zone; resolved once, not per check
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+# Archived page bodies are stored zstd-compressed
+ARCHIVE_COMPRESSOR = zstd.ZstdCompressor(level=3)
+ARCHIVE_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+MEDIA_SEND_CONCURRENCY = 8  # Resources downloaded and sent in parallel per check
+STATS_FLUSH_SIZE = 500  # Buffered statistics counters that force an immediate flush
+STATS_FLUSH_INTERVAL = 1  # Seconds between background statistics flushes
+DIFF_MAX_CHARS = 200_000  # Characters of each page version fed to the differ
+CONTENT_CHANGED_ARCHIVE_ONLY = True  # Archive a page only when its content changed
+MAX_CHECK_CONCURRENCY = 32  # check_updates calls running at once in check_many
+
+SPOOL_MAX_SIZE = 8 << 20  # Downloads up to this size stay in memory when sending media
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+TOO_LARGE = object()  # stream_download/send_media result for files over MAX_FILE_SIZE
+MAX_SEND_ATTEMPTS = 3  # Checks that try a failing resource before it is skipped for good
+
+# Buffered stats field -> stats_rollup counters it increments
+ROLLUP_COUNTERS = {
+    'stats.checks.success': ('success_checks', 'total_checks'),
+    'stats.checks.failure': ('total_checks',),
+    'stats.downloads.success': ('success_downloads',),
+    'stats.downloads.failure': ('failed_downloads',),
+    'stats.content_changes.success': ('content_changes',),
+}
+
+# Final stage writing rollup_pipeline output into stats_rollup (needs its unique user_id index)
+ROLLUP_MERGE = {'$merge': {
+    'into': 'stats_rollup',
+    'on': 'user_id',
+    'whenMatched': 'replace',
+    'whenNotMatched': 'insert'
+}}
+
+EXPORT_FIELDS = ['url', 'name', 'night_mode', 'content_hash', 'last_checked']
+
+# Flat extension -> resource type lookup, one dict probe per link; the first
+# type listing an extension wins, as with the loop it replaces
+EXT_TO_TYPE = {}
+for _file_type, _extensions in SUPPORTED_EXTENSIONS.items():
+    for _ext in _extensions:
+        EXT_TO_TYPE.setdefault(_ext, _file_type)
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Shared HTTP session for page checks; pools TCP/TLS connections and DNS"""
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=4, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector)
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+META_CHARSET_SCAN = 64 * 1024  # Bytes of the page searched for a <meta> charset
+
+def resolve_charset(header_charset: Optional[str], body: bytes) -> str:
+    """Charset to decode a page with: the header's if Python knows it, else the page's <meta>, else UTF-8"""
+    if header_charset:
+        try:
+            return codecs.lookup(header_charset).name
+        except LookupError:
+            pass  # e.g. utf8mb4
+    meta = META_CHARSET_RE.search(body, 0, META_CHARSET_SCAN)
+    if meta:
+        try:
+            return codecs.lookup(meta.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+def is_same_content(stored_hash: str, current_hash: str, content: str) -> bool:
+    """Compare against a stored hash, accepting the MD5/SHA-256 hashes written before xxh3"""
+    if stored_hash == current_hash:
+        return True
+    if len(stored_hash) == 32:
+        return hashlib.md5(content.encode()).hexdigest() == stored_hash
+    if len(stored_hash) == 64:
+        return hashlib.sha256(content.encode()).hexdigest() == stored_hash
+    return False
 
 async def track_statistics(self, event_type: str, user_id: int, url: str, success: bool = True):
-    """Record statistics for analysis with validation"""
+    """Record statistics for analysis with validation (buffered, see flush_statistics)
+
+    Never writes or raises itself, so a failing database can't break a check.
+    """
     # Validate event type to prevent injection
     valid_events = {'downloads', 'checks', 'content_changes'}
     if event_type not in valid_events:
-        raise ValueError(f"Invalid event type: {event_type}")
-    
-    # Use bulk writes for better performance if tracking multiple stats
-    await MongoDB.stats.update_one(
-        {'user_id': user_id, 'url': url},
-        {'$inc': {f'stats.{event_type}.{"success" if success else "failure"}': 1},
-        upsert=True
-    )
+        logger.error(f"Invalid event type: {event_type}")
+        return
+
+    field = f'stats.{event_type}.{"success" if success else "failure"}'
+    self._stats_buf[(user_id, url, field)] += 1
+    if len(self._stats_buf) >= STATS_FLUSH_SIZE:
+        self._stats_flush_now.set()  # Wake stats_flusher before its interval ends
+
+async def flush_statistics(self):
+    """Flush buffered statistics; excluded while a rollup rebuild runs"""
+    async with self._stats_lock:
+        await self._write_stats_buf()
+
+async def _write_stats_buf(self):
+    """Write buffered statistics counters and per-user rollups in unordered bulk_writes
+
+    Counters whose write fails go back into the buffer for the next flush.
+    Callers hold self._stats_lock.
+    """
+    if not self._stats_buf:
+        return
+
+    batch, self._stats_buf = self._stats_buf, Counter()
+    items = list(batch.items())
+    applied = batch
+    try:
+        await MongoDB.stats.bulk_write([
+            UpdateOne({'user_id': user_id, 'url': url}, {'$inc': {field: count}}, upsert=True)
+            for (user_id, url, field), count in items
+        ], ordered=False)
+    except BulkWriteError as e:
+        # Unordered: every operation but the reported ones was applied
+        failed = {error['index'] for error in e.details.get('writeErrors', [])}
+        applied = Counter()
+        for index, (key, count) in enumerate(items):
+            (self._stats_buf if index in failed else applied)[key] += count
+        logger.error(f"Statistics flush partially failed, {len(failed)} counters requeued")
+    except Exception:
+        self._stats_buf.update(batch)  # Retried on the next flush
+        raise
+
+    rollups = defaultdict(Counter)
+    for (user_id, _, field), count in applied.items():
+        for counter in ROLLUP_COUNTERS.get(field, ()):
+            rollups[user_id][counter] += count
+    if rollups:
+        try:
+            await MongoDB.stats_rollup.bulk_write([
+                UpdateOne({'user_id': user_id}, {'$inc': dict(counters)}, upsert=True)
+                for user_id, counters in rollups.items()
+            ], ordered=False)
+        except Exception as e:
+            # stats already holds these counts; aggregate_statistics rebuilds the rollups
+            logger.error(f"Statistics rollup update failed: {str(e)}")
+
+async def stats_flusher(self):
+    """Background task flushing buffered statistics, once more when cancelled"""
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(self._stats_flush_now.wait(), STATS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._stats_flush_now.clear()
+            try:
+                await self.flush_statistics()
+            except Exception as e:
+                logger.error(f"Statistics flush failed: {str(e)}")
+                # Requeued counters keep the buffer full; don't retry in a tight loop
+                await asyncio.sleep(STATS_FLUSH_INTERVAL)
+    except asyncio.CancelledError:
+        await self.flush_statistics()  # Don't drop counters buffered at shutdown
+        raise
 
 async def get_statistics(self, user_id: int) -> Dict:
-    """Get accurate aggregated statistics for user"""
-    pipeline = [
-        {'$match': {'user_id': user_id}},
+    """Get statistics for user from the rollup kept current by flush_statistics"""
+    rollup, total_tracked = await asyncio.gather(
+        MongoDB.stats_rollup.find_one({'user_id': user_id}, {'_id': 0}),
+        MongoDB.urls.count_documents({'user_id': user_id})
+    )
+    rollup = rollup or {}
+    total_checks = rollup.get('total_checks', 0)
+
+    return {
+        'total_tracked': total_tracked,
+        'success_downloads': rollup.get('success_downloads', 0),
+        'failed_downloads': rollup.get('failed_downloads', 0),
+        'uptime_percentage': rollup.get('success_checks', 0) / total_checks if total_checks else 0
+    }
+
+def rollup_pipeline(match: Dict) -> List[Dict]:
+    """Pipeline computing stats_rollup documents from the per-URL stats"""
+    return [
+        {'$match': match},
         {'$group': {
-            '_id': None,
-            'total_tracked': {'$sum': 1},
+            '_id': '$user_id',
+            'success_checks': {'$sum': '$stats.checks.success'},
+            # $add yields null if either side is missing, which $sum would skip
             'total_checks': {
                 '$sum': {
                     '$add': [
-                        '$stats.checks.success',
-                        '$stats.checks.failure'
+                        {'$ifNull': ['$stats.checks.success', 0]},
+                        {'$ifNull': ['$stats.checks.failure', 0]}
                     ]
                 }
             },
-            'success_checks': {'$sum': '$stats.checks.success'},
             'success_downloads': {'$sum': '$stats.downloads.success'},
             'failed_downloads': {'$sum': '$stats.downloads.failure'},
+            'content_changes': {'$sum': '$stats.content_changes.success'},
         }},
         {'$project': {
-            'total_tracked': 1,
+            '_id': 0,
+            'user_id': '$_id',
+            'success_checks': 1,
+            'total_checks': 1,
             'success_downloads': 1,
             'failed_downloads': 1,
-            'uptime_percentage': {
-                '$cond': [
-                    {'$eq': ['$total_checks', 0]},
-                    0,
-                    {'$divide': ['$success_checks', '$total_checks']}
-                ]
-            }
+            'content_changes': 1,
         }}
     ]
 
-    result = await MongoDB.stats.aggregate(pipeline).to_list(1)
-    return result[0] if result else {}
+async def rebuild_stats_rollup(self, user_id: int):
+    """Recompute a user's rollup from the per-URL stats, e.g. after a manual fix-up"""
+    # No flush may $inc the rollup between the pipeline's read and its $merge
+    async with self._stats_lock:
+        await self._write_stats_buf()
+        cursor = await MongoDB.stats.aggregate(rollup_pipeline({'user_id': user_id}) + [ROLLUP_MERGE])
+        await cursor.to_list(None)
+
+@alru_cache(maxsize=2048, ttl=60)
+async def filter_settings(self, user_id: int) -> Dict:
+    """User filter settings, cached since every resource on a page consults them"""
+    return await MongoDB.filters.find_one({'user_id': user_id}, {'_id': 0}) or {}
+
+async def apply_filters(self, resource: Dict, user_id: int) -> bool:
+    """Check a resource against the user's allowed types and blocked extensions"""
+    settings = await self.filter_settings(user_id)
+
+    allowed_types = settings.get('types')
+    if allowed_types and resource['type'] not in allowed_types:
+        return False
+
+    ext = os.path.splitext(resource['url'])[1].lower()
+    return ext not in settings.get('blocked_extensions', [])
+
+async def _get_content_shared(self, url: str, previous_hash: str):
+    """get_webpage_content, coalescing concurrent calls for the same page
+
+    Keyed on (url, previous_hash) because the hash short-circuit depends on
+    the caller's stored hash; subscribers in sync share one fetch and parse.
+    The shared result must be treated as read-only.
+    """
+    key = (url, previous_hash)
+    task = self._inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(self.get_webpage_content(url, previous_hash))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+    # Shielded so one cancelled check doesn't cancel the fetch for the others
+    return await asyncio.shield(task)
 
 async def check_updates(self, user_id: int, url: str):
     """Consolidated update checking logic"""
@@ -65,25 +281,35 @@ async def check_updates(self, user_id: int, url: str):
         if not tracked_data:
             return
 
+        # One clock reading per check, shared by night mode, archive and last_checked
+        now = datetime.now(LOCAL_TZ)
+
         # Night mode check
         if tracked_data.get('night_mode'):
-            tz = pytz.timezone(TIMEZONE)
-            now = datetime.now(tz)
             if not (9 <= now.hour < 22):
                 logger.info(f"Night mode active, skipping {url}")
                 await self.track_statistics('checks', user_id, url, success=False)
                 return
 
-        current_content, new_resources = await self.get_webpage_content(url)
-        await self.create_archive(user_id, url, current_content)
-
         previous_hash = tracked_data.get('content_hash', '')
-        current_hash = hashlib.sha256(current_content.encode()).hexdigest()  # Better hash
+        # Media that failed to send last time is retried even if the page is unchanged,
+        # so the unchanged-body shortcut only applies when nothing is pending
+        pending_sends = tracked_data.get('pending_sends', False)
+        skip_if_hash = '' if pending_sends else previous_hash
+        current_content, new_resources, current_hash = await self._get_content_shared(url, skip_if_hash)
+        if current_content is None:
+            # Unchanged since the last check: nothing to archive, diff or send
+            await self.track_statistics('checks', user_id, url, success=True)
+            return
+
+        content_changed = not is_same_content(previous_hash, current_hash, current_content)
+        if content_changed or not CONTENT_CHANGED_ARCHIVE_ONLY:
+            await self.create_archive(user_id, url, current_content, current_hash, now)
 
         changes_detected = False
         text_changes = ""
 
-        if current_hash != previous_hash:
+        if content_changed:
             old_content = tracked_data.get('content', '')
             if old_content:
                 diff_content = await self.generate_diff(old_content, current_content)
@@ -94,33 +320,62 @@ async def check_updates(self, user_id: int, url: str):
             changes_detected = True
             await self.track_statistics('content_changes', user_id, url)
 
-        filtered_resources = [
+        # Evaluate filters for unsent resources in one concurrent wave
+        already_sent = set(tracked_data.get('sent_hashes', []))
+        already_sent.update(tracked_data.get('skipped_hashes', []))
+        candidates = [
             resource for resource in new_resources
-            if await self.apply_filters(resource, user_id)
+            if resource['hash'] not in already_sent
         ]
+        mask = await asyncio.gather(*[self.apply_filters(r, user_id) for r in candidates])
+        filtered_resources = [r for r, keep in zip(candidates, mask) if keep]
+
+        # Download and send concurrently, capped to spare Telegram and the DB
+        send_sem = asyncio.Semaphore(MEDIA_SEND_CONCURRENCY)
 
-        sent_hashes = []
-        for resource in filtered_resources:
-            if resource['hash'] not in tracked_data.get('sent_hashes', []):
-                if await self.send_media(user_id, resource, tracked_data):
-                    sent_hashes.append(resource['hash'])
-                    await self.track_statistics('downloads', user_id, url, success=True)
+        async def send_one(resource):
+            async with send_sem:
+                return resource['hash'], await self.send_media(user_id, resource, tracked_data)
+
+        # Failed sends are retried on later checks, up to MAX_SEND_ATTEMPTS;
+        # oversized files and resources out of attempts are skipped for good
+        previous_failures = tracked_data.get('send_failures', {})
+        sent_hashes, skipped_hashes, send_failures = [], [], {}
+        for resource_hash, result in await asyncio.gather(*map(send_one, filtered_resources)):
+            if result is True:
+                sent_hashes.append(resource_hash)
+            else:
+                attempts = previous_failures.get(resource_hash, 0) + 1
+                if result is TOO_LARGE or attempts >= MAX_SEND_ATTEMPTS:
+                    skipped_hashes.append(resource_hash)
                 else:
-                    await self.track_statistics('downloads', user_id, url, success=False)
+                    send_failures[resource_hash] = attempts
+            await self.track_statistics('downloads', user_id, url, success=result is True)
 
-        if changes_detected or sent_hashes:
+        still_pending = bool(send_failures)
+        # A legacy MD5/SHA-256 match also needs its hash rewritten as xxh3,
+        # or the unchanged-body shortcut never applies to this URL
+        hash_outdated = current_hash != previous_hash
+        if (changes_detected or hash_outdated or sent_hashes or skipped_hashes
+                or still_pending != pending_sends or send_failures != previous_failures):
             if text_changes:
                 await self.safe_send_message(user_id, text_changes)
 
-            update_data = {
+            update = {'$set': {
                 'content_hash': current_hash,
-                'last_checked': datetime.now(),
-                '$push': {'sent_hashes': {'$each': sent_hashes}}
-            }
-            await MongoDB.urls.update_one(
-                {'_id': tracked_data['_id']},
-                {'$set': update_data}
-            )
+                'last_checked': now,
+                'pending_sends': still_pending,
+                'send_failures': send_failures
+            }}
+            push = {}
+            if sent_hashes:
+                push['sent_hashes'] = {'$each': sent_hashes}
+            if skipped_hashes:
+                push['skipped_hashes'] = {'$each': skipped_hashes}
+            if push:
+                update['$push'] = push
+
+            await MongoDB.urls.update_one({'_id': tracked_data['_id']}, update)
 
         await self.track_statistics('checks', user_id, url, success=True)
 
@@ -129,8 +384,74 @@ async def check_updates(self, user_id: int, url: str):
         await self.track_statistics('checks', user_id, url, success=False)
         await self.app.send_message(user_id, f"⚠️ Error checking {url}: {str(e)}")
 
-async def send_media(self, user_id: int, resource: Dict, tracked_data: Dict) -> bool:
-    """Improved media sending with temp files and retries"""
+async def check_many(self, user_ids_urls: List[Tuple[int, str]]):
+    """Run check_updates for many (user_id, url) pairs with bounded concurrency"""
+    check_sem = asyncio.Semaphore(MAX_CHECK_CONCURRENCY)
+
+    async def check_one(user_id, url):
+        async with check_sem:
+            await self.check_updates(user_id, url)
+
+    # One failing check must not abandon the rest of the run
+    results = await asyncio.gather(
+        *(check_one(user_id, url) for user_id, url in user_ids_urls),
+        return_exceptions=True
+    )
+    for (user_id, url), result in zip(user_ids_urls, results):
+        if isinstance(result, Exception):
+            logger.error(f"Check failed for {url} (user {user_id}): {str(result)}")
+
+async def check_all_urls(self):
+    """Scheduler entry point: check every tracked URL"""
+    cursor = MongoDB.urls.find({}, {'user_id': 1, 'url': 1})
+    await self.check_many([(doc['user_id'], doc['url']) async for doc in cursor])
+
+async def stream_download(self, url: str, spill_path: str):
+    """Download url for upload, in memory unless it outgrows SPOOL_MAX_SIZE
+
+    Returns a file object rewound to the start whose str .name Pyrogram
+    uploads under: a BytesIO, or a file at spill_path once the body passes
+    SPOOL_MAX_SIZE. Returns TOO_LARGE once the body passes MAX_FILE_SIZE
+    (the rest is never downloaded), or None on error.
+    """
+    buffer = io.BytesIO()
+    buffer.name = os.path.basename(spill_path)
+    try:
+        async with self.http.get(url) as resp:
+            if resp.status != 200:
+                buffer.close()
+                return None
+            if (resp.content_length or 0) > MAX_FILE_SIZE:
+                buffer.close()
+                return TOO_LARGE
+
+            size = 0
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    buffer.close()
+                    return TOO_LARGE
+                if size > SPOOL_MAX_SIZE and isinstance(buffer, io.BytesIO):
+                    # Large file: continue on disk instead of growing the buffer
+                    spilled = open(spill_path, 'w+b')
+                    spilled.write(buffer.getvalue())
+                    buffer.close()
+                    buffer = spilled
+                buffer.write(chunk)
+    except Exception as e:
+        logger.warning(f"Direct download failed for {url}: {str(e)}")
+        buffer.close()
+        return None
+
+    buffer.seek(0)
+    return buffer
+
+async def send_media(self, user_id: int, resource: Dict, tracked_data: Dict):
+    """Improved media sending, streamed through memory with a yt-dlp fallback
+
+    Returns True once sent, TOO_LARGE for files over MAX_FILE_SIZE (not
+    worth retrying), or False on any other failure.
+    """
     try:
         caption = (
             f"📁 {tracked_data.get('name', 'Unnamed')}\n"
@@ -138,52 +459,102 @@ async def send_media(self, user_id: int, resource: Dict, tracked_data: Dict) ->
             f"📥 Direct URL: {resource['url']}"
         )
 
+        # Use appropriate send method
+        send_methods = {
+            'pdf': self.app.send_document,
+            'image': self.app.send_photo,
+            'audio': self.app.send_audio,
+            'video': self.app.send_video
+        }
+
+        method = send_methods.get(resource['type'], self.app.send_document)
+        file_name = os.path.basename(resource['url'])
+        send_kwargs = {'caption': caption[:1024], 'parse_mode': enums.ParseMode.HTML}
+        if method is not self.app.send_photo:
+            send_kwargs['file_name'] = file_name
+
         with TemporaryDirectory() as tmpdir:
-            file_path = os.path.join(tmpdir, os.path.basename(resource['url']))
-            
-            # Try multiple download methods
-            downloaders = [self.ytdl_download, self.direct_download]
-            for downloader in downloaders:
-                if await downloader(resource['url'], file_path):
-                    break
-            else:
+            file_path = os.path.join(tmpdir, file_name)
+
+            media = await self.stream_download(resource['url'], file_path)
+            if media is TOO_LARGE:
+                logger.warning(f"File too big, skipped: {resource['url']}")
+                return TOO_LARGE
+            if media is not None:
+                with media:
+                    await method(user_id, media, **send_kwargs)
+                return True
+
+            # Not directly downloadable; let yt-dlp extract it
+            if not await self.ytdl_download(resource['url'], file_path):
                 return False
 
             file_size = os.path.getsize(file_path)
             if file_size > MAX_FILE_SIZE:
                 logger.warning(f"File too big: {file_size} bytes")
-                return False
+                return TOO_LARGE
 
-            # Use appropriate send method
-            send_methods = {
-                'pdf': self.app.send_document,
-                'image': self.app.send_photo,
-                'audio': self.app.send_audio,
-                'video': self.app.send_video
-            }
-
-            method = send_methods.get(resource['type'], self.app.send_document)
-            await method(
-                user_id,
-                file_path,
-                caption=caption[:1024],
-                parse_mode=enums.ParseMode.HTML
-            )
+            await method(user_id, file_path, **send_kwargs)
 
         return True
     except Exception as e:
         logger.error(f"Media send failed: {str(e)}")
         return False
 
+def _write_export(path: str, format: str, docs: List[Dict]):
+    """Render an export file in json or csv"""
+    if format == 'json':
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(docs))
+    else:
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(docs)
+
+async def export_data(self, user_id: int, format: str) -> str:
+    """Export the user's tracked URLs as json/csv into a temp file the caller removes"""
+    docs = await MongoDB.urls.find(
+        {'user_id': user_id},
+        {'_id': 0, **{field: 1 for field in EXPORT_FIELDS}}
+    ).sort('url', 1).to_list(None)
+
+    fd, path = mkstemp(prefix=f"export-{user_id}-", suffix=f".{format}")
+    os.close(fd)
+    await asyncio.to_thread(_write_export, path, format, docs)
+    return path
+
+async def ensure_indexes(self):
+    """Create the indexes check_updates and the dashboards rely on"""
+    await MongoDB.urls.create_index([('user_id', 1), ('url', 1)], unique=True)
+    await MongoDB.stats.create_index([('user_id', 1), ('url', 1)], unique=True)
+    await MongoDB.stats_rollup.create_index('user_id', unique=True)
+    await MongoDB.archives.create_index([('user_id', 1), ('url', 1), ('timestamp', -1)])
+    # Mongo's TTL monitor expires old archives, replacing cleanup_old_archives
+    await MongoDB.archives.create_index(
+        [('timestamp', 1)],
+        expireAfterSeconds=ARCHIVE_RETENTION_DAYS * 86400
+    )
+
 async def safe_send_message(self, user_id: int, text: str):
     """Handle message splitting and formatting"""
     MAX_LENGTH = 4096  # Telegram message limit
-    while text:
-        chunk, text = text[:MAX_LENGTH], text[MAX_LENGTH:]
-        await self.app.send_message(user_id, chunk)
-        await asyncio.sleep(0.5)  # Prevent flooding
-
-# Suggested database indexes (add during initialization)
-# MongoDB.stats.create_index([('user_id', 1), ('url', 1)])
-# MongoDB.archives.create_index([('user_id', 1), ('url', 1), ('timestamp', -1)])
-# MongoDB.archives.create_index([('timestamp', 1)], expireAfterSeconds=ARCHIVE_RETENTION_DAYS*86400)
+    for start in range(0, len(text), MAX_LENGTH):
+        chunk = text[start:start + MAX_LENGTH]
+        while True:
+            try:
+                await self.app.send_message(user_id, chunk)
+                break
+            except FloodWait as e:
+                # Only back off when Telegram actually asks us to
+                await asyncio.sleep(e.value)
+
+# Add during initialization
+# self.http = create_http_session()
+# self._inflight = {}
+# self._stats_buf = Counter()
+# self._stats_lock = asyncio.Lock()
+# self._stats_flush_now = asyncio.Event()
+# self._stats_task = asyncio.create_task(self.stats_flusher())
+# await self.ensure_indexes()
+# scheduler.add_job(self.aggregate_statistics, 'interval', hours=1, max_instances=1, coalesce=True)